@@ -1,20 +1,37 @@
 from __future__ import annotations
 
+import struct
+import queue
+import threading
+from contextlib import contextmanager
 from typing import Optional
 
 import serial
 
 
+_S_BYTE = struct.Struct(">cB")
+_S_MOD_BYTE = struct.Struct(">cBB")
+_S_SPEED = struct.Struct(">cBH")
+_S_MOD_TARGET = struct.Struct(">cBi")
+_S_SUB_TARGET = struct.Struct(">cBBi")
+
+
 def escape_message(msg):
-    result = bytearray()
-    for c in msg:
-        if c >= 0xfc:
-            result.append(0xfc)
-        result.append(c)
-    return result
+    # Every byte in 0xfc-0xff is prefixed with 0xfc. Any negative int field contains 0xff, so escaping
+    # is common. A replace that finds nothing is a single memchr scan, which beats checking first
+    return (bytes(msg).replace(b"\xfc", b"\xfc\xfc")
+                      .replace(b"\xfd", b"\xfc\xfd")
+                      .replace(b"\xfe", b"\xfc\xfe")
+                      .replace(b"\xff", b"\xfc\xff"))
+
+
+def _frame(payload):
+    return b"\xfd" + escape_message(payload) + b"\xfe"
 
 
 def range_validate_int(val, minimum, maximum, param_name):
+    if type(val) is int and minimum <= val <= maximum:
+        return val
     if not isinstance(val, int):
         raise ValueError(f"Parameter '{param_name}' must be an int, received {type(val)}")
     if minimum <= val <= maximum:
@@ -39,72 +56,56 @@ class MaxyMessages:
 
     @classmethod
     def reset_all_module_config_message(cls):
-        return cls.MID_RESET_CONFIG
+        return _frame(cls.MID_RESET_CONFIG)
 
     @classmethod
     def set_all_module_intensity(cls, intensity):
         range_validate_int(intensity, 0, 15, "intensity")
-        intensity_raw = intensity.to_bytes(length=1, byteorder="big", signed=False)
-        return cls.MID_SET_ALL_INTENSITY + intensity_raw
+        return _frame(_S_BYTE.pack(cls.MID_SET_ALL_INTENSITY, intensity))
 
     @classmethod
     def set_module_target_message(cls, module_index, target):
         range_validate_int(module_index, 0, 63, "module_index")
         range_validate_int(target, -9999999, 99999999, "target")
-        module_raw = module_index.to_bytes(length=1, byteorder="big", signed=False)
-        target_raw = target.to_bytes(length=4, byteorder="big", signed=True)
-        return cls.MID_SET_MODULE_TARGET + module_raw + target_raw
+        return _frame(_S_MOD_TARGET.pack(cls.MID_SET_MODULE_TARGET, module_index, target))
 
     @classmethod
     def set_module_immediate_target_message(cls, module_index,  target):
         range_validate_int(module_index, 0, 63, "module_index")
         range_validate_int(target, -9999999, 99999999, "target")
-        module_raw = module_index.to_bytes(length=1, byteorder="big", signed=False)
-        target_raw = target.to_bytes(length=4, byteorder="big", signed=True)
-        return cls.MID_SET_MODULE_IMMEDIATE_TARGET + module_raw + target_raw
+        return _frame(_S_MOD_TARGET.pack(cls.MID_SET_MODULE_IMMEDIATE_TARGET, module_index, target))
 
     @classmethod
     def set_sub_module_immediate_target_message(cls, module_index, sub_module, target):
         range_validate_int(module_index, 0, 63, "module_index")
+        range_validate_int(sub_module, 0, 7, "sub_module")
         range_validate_int(target, -9999999, 99999999, "target")
-        module_raw = module_index.to_bytes(length=1, byteorder="big", signed=False)
-        sub_module_raw = sub_module.to_bytes(length=1, byteorder="big", signed=False)
-        target_raw = target.to_bytes(length=4, byteorder="big", signed=True)
-        return cls.MID_SET_SUB_MODULE_IMMEDIATE_TARGET + module_raw + sub_module_raw + target_raw
+        return _frame(_S_SUB_TARGET.pack(cls.MID_SET_SUB_MODULE_IMMEDIATE_TARGET, module_index, sub_module, target))
 
     @classmethod
     def set_sub_module_target_message(cls, module_index, sub_module, target):
         range_validate_int(module_index, 0, 63, "module_index")
         range_validate_int(sub_module, 0, 7, "sub_module")
         range_validate_int(target, -9999999, 99999999, "target")
-        module_raw = module_index.to_bytes(length=1, byteorder="big", signed=False)
-        sub_module_raw = sub_module.to_bytes(length=1, byteorder="big", signed=False)
-        target_raw = target.to_bytes(length=4, byteorder="big", signed=True)
-        return cls.MID_SET_SUB_MODULE_TARGET + module_raw + sub_module_raw + target_raw
+        return _frame(_S_SUB_TARGET.pack(cls.MID_SET_SUB_MODULE_TARGET, module_index, sub_module, target))
 
     @classmethod
     def set_module_intensity(cls, module_index, intensity):
         range_validate_int(module_index, 0, 63, "module_index")
-        range_validate_int(module_index, 0, 15, "intensity")
-        module_raw = module_index.to_bytes(length=1, byteorder="big", signed=False)
-        intensity_raw = intensity.to_bytes(length=1, byteorder="big", signed=False)
-        return cls.MID_SET_MODULE_INTENSITY + module_raw + intensity_raw
+        range_validate_int(intensity, 0, 15, "intensity")
+        return _frame(_S_MOD_BYTE.pack(cls.MID_SET_MODULE_INTENSITY, module_index, intensity))
 
     @classmethod
-    def set_module_speed_divider(cls, module_index, intensity):
+    def set_module_speed_divider(cls, module_index, speed_divider):
         range_validate_int(module_index, 0, 63, "module_index")
-        range_validate_int(module_index, 0, 65000, "speed_divider")
-        module_raw = module_index.to_bytes(length=1, byteorder="big", signed=False)
-        speed_divider_raw = intensity.to_bytes(length=2, byteorder="big", signed=False)
-        return cls.MID_SET_MODULE_INTENSITY + module_raw + speed_divider_raw
+        range_validate_int(speed_divider, 0, 65000, "speed_divider")
+        return _frame(_S_SPEED.pack(cls.MID_SET_MODULE_SPEED_DIVIDER, module_index, speed_divider))
     
     @classmethod
     def set_module_type(cls, module_index, module_type):
         range_validate_int(module_index, 0, 63, "module_index")
         range_validate_int(module_type, 0, 63, "module_type")
-        module_raw = module_index.to_bytes(length=1, byteorder="big", signed=False)
-        module_type_raw = module_type.to_bytes(length=1, byteorder="big", signed=False)
-        return cls.MID_SET_MODULE_TYPE + module_raw + module_type_raw
+        return _frame(_S_MOD_BYTE.pack(cls.MID_SET_MODULE_TYPE, module_index, module_type))
 
 
 class DictObject(object):
@@ -115,17 +116,16 @@ class DictObject(object):
         self.values = {}
 
     def __getitem__(self, item):
-        if item in self.values:
-            return self.values[item]
-        raise KeyError(item)
+        return self.values[item]
     
     def __setitem__(self, key, value):
         self.values[key] = value
 
     def __getattr__(self, item):
-        if item in self.values:
+        try:
             return self.values[item]
-        raise AttributeError(item)
+        except KeyError:
+            raise AttributeError(item) from None
 
     def __contains__(self, item):
         return item in self.values
@@ -148,13 +148,62 @@ class DictObject(object):
             v = self.values[k]
             value_list.append(str(k) + "=" + str(v))
         return "{" + ", ".join(value_list) + "}"
-    
+
+
+class _SerialWriter:
+
+    QUEUE_SIZE = 64
+
+    __slots__ = ("_queue", "_write_timeout", "_stopped", "error")
+
+    def __init__(self, port: serial.Serial, write_timeout: Optional[float]):
+        # Each connection gets its own writer, so a late failure on an old port can't leak into a new one
+        self._queue: queue.Queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._write_timeout = write_timeout
+        self._stopped = False
+        self.error: Optional[Exception] = None
+        threading.Thread(target=self._run, args=(port,), name="MaxyWriter", daemon=True).start()
+
+    def _run(self, port):
+        while True:
+            data = self._queue.get()
+            if data is None or self._stopped:
+                return
+            try:
+                port.write(data)
+            except Exception as e:
+                # Raised again from the next write so the caller can reconnect
+                self.error = e
+                return
+
+    def write(self, data):
+        if self.error is not None:
+            raise self.error
+        try:
+            self._queue.put(data, timeout=self._write_timeout)
+        except queue.Full:
+            raise serial.SerialTimeoutException("Write timeout") from None
+
+    def stop(self):
+        self._stopped = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+
 class MaxyController:
 
+    __slots__ = ("_serial", "index", "name", "_batch", "_batch_undo", "_write", "_writer")
+
     def __init__(self):
         self._serial: Optional[serial.Serial] = None
         self.index: list[MaxyModule] = []
         self.name: DictObject[str, MaxyModule] = DictObject()
+        self._batch: Optional[dict] = None
+        self._batch_undo: list[tuple] = []
+        self._write = self._write_closed
+        self._writer: Optional[_SerialWriter] = None
 
     def define_modules(self, module_definitions: list[MaxModuleDef]):
         self.index.clear()
@@ -173,15 +222,27 @@ class MaxyController:
                     if name:
                         self.name[name] = new_module.sub_modules[sub_module_index]
 
-    def connect(self, port: str, baudrate: int = 9600, timeout: float = 5):
-        self._serial = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+    def connect(self, port: str, baudrate: int = 9600, timeout: float = 5, write_timeout: Optional[float] = None,
+                background_writes: bool = False):
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+        self._write = self._write_closed
+        self._serial = serial.Serial(port, baudrate=baudrate, timeout=timeout, write_timeout=write_timeout)
+        if background_writes:
+            self._writer = _SerialWriter(self._serial, write_timeout)
+            self._write = self._writer.write
+        else:
+            # pyserial raises on writes to a closed port, so the open check is not repeated per message
+            self._write = self._serial.write
         self.configure_module_types()
 
     def configure_module_types(self):
-        for module in self.index:
-            self.send_message(
-                MaxyMessages.set_module_type(module.module_index, module.MODULE_TYPE_ID)
-            )
+        with self.batch():
+            for module in self.index:
+                self.send_message(
+                    MaxyMessages.set_module_type(module.module_index, module.MODULE_TYPE_ID)
+                )
             
     def set_global_intensity(self, intensity):
         self.send_message(MaxyMessages.set_all_module_intensity(intensity))
@@ -193,21 +254,67 @@ class MaxyController:
         else:
             raise IOError("The serial connection is closed")
 
-    def send_message(self, msg):
-        self.serial.write(b"\xfd" + escape_message(msg) + b"\xfe")
+    @property
+    def is_connected(self):
+        return bool(self._serial and self._serial.isOpen())
+
+    def _write_closed(self, data):
+        raise IOError("The serial connection is closed")
+
+    @contextmanager
+    def batch(self):
+        # Collects every message sent inside the block and writes them out with a single write call.
+        # Messages sent with the same key replace each other, so only the latest one is written
+        if self._batch is not None:
+            yield
+            return
+        self._batch = {}
+        try:
+            yield
+        except BaseException:
+            # Half-built updates are dropped rather than sent. The cached values they changed are restored
+            # so the dedup checks don't skip the next attempt
+            self._batch = None
+            for obj, attr, previous in reversed(self._batch_undo):
+                setattr(obj, attr, previous)
+            self._batch_undo.clear()
+            raise
+        frames = self._batch
+        self._batch = None
+        self._batch_undo.clear()
+        if frames:
+            self._write(b"".join(frames.values()))
+
+    def send_message(self, msg, key=None, undo=None):
+        # msg is a complete frame as returned by the MaxyMessages builders.
+        # undo is an (object, attribute, previous value) tuple restored if the batch holding msg is dropped
+        if self._batch is None:
+            self._write(msg)
+            return
+        if undo is not None:
+            self._batch_undo.append(undo)
+        if key is None:
+            self._batch[object()] = msg
+        else:
+            # Re-inserting moves the message after anything sent since its previous version
+            self._batch.pop(key, None)
+            self._batch[key] = msg
 
 
 def clamp(value, min_value, max_value):
-    return min(max_value, max(min_value, value))
+    return min_value if value < min_value else max_value if value > max_value else value
 
 
 class MaxyModule:
 
+    __slots__ = ("controller", "module_index", "_intensity", "sub_modules")
+
     SUB_MODULE_COUNT = 1
     TARGET_MIN = -9999999
     TARGET_MAX = 99999999
     MODULE_TYPE_ID = 0
     ALLOW_MAIN_MODULE_TARGET_CHANGES = True
+    FORCE_IMMEDIATE = False
     
     def __init__(self, controller: MaxyController, module_index: int) -> None:
         self.controller = controller
@@ -221,8 +328,9 @@ class MaxyModule:
     def _set_intensity(self, intensity):
         intensity = clamp(intensity, 0, 15)
         if intensity != self._intensity:
+            undo = (self, "_intensity", self._intensity)
             self._intensity = intensity
-            self.controller.send_message(MaxyMessages.set_module_intensity(self.module_index, intensity))
+            self.controller.send_message(MaxyMessages.set_module_intensity(self.module_index, intensity), undo=undo)
 
     intensity = property(_get_intensity, _set_intensity)
     
@@ -230,7 +338,6 @@ class MaxyModule:
         if not self.ALLOW_MAIN_MODULE_TARGET_CHANGES:
             raise TypeError("You can't change the target directly on this module. Change it on submodules instead")
         self.sub_modules[0].target = target
-        target = clamp(target, self.TARGET_MIN, self.TARGET_MAX)
 
     def _get_target(self):
         return self.sub_modules[0].target
@@ -247,6 +354,8 @@ class MaxyModule:
 
 class MaxyModule_8x7seg(MaxyModule):
     
+    __slots__ = ()
+
     SUB_MODULE_COUNT = 1
     TARGET_MIN = -9999999
     TARGET_MAX = 99999999
@@ -255,6 +364,8 @@ class MaxyModule_8x7seg(MaxyModule):
 
 class MaxyModule_2x4x7seg(MaxyModule):
     
+    __slots__ = ()
+
     SUB_MODULE_COUNT = 2
     TARGET_MIN = -999
     TARGET_MAX = 9999
@@ -263,6 +374,8 @@ class MaxyModule_2x4x7seg(MaxyModule):
     
 class MaxySubModule:
     
+    __slots__ = ("module", "sub_module_id", "_target")
+
     def __init__(self, module, sub_module_id):
         self.module = module
         self.sub_module_id = sub_module_id
@@ -271,13 +384,16 @@ class MaxySubModule:
     def _set_target(self, target):
         target = clamp(target, self.module.TARGET_MIN, self.module.TARGET_MAX)
         if target != self._target:
+            undo = (self, "_target", self._target)
             self._target = target
             self.module.controller.send_message(
                 MaxyMessages.set_sub_module_target_message(
                     self.module.module_index,
                     self.sub_module_id,
                     target,
-                ))
+                ),
+                key=(self.module.module_index, self.sub_module_id),
+                undo=undo)
     
     def _get_target(self):
         return self._target
@@ -286,20 +402,24 @@ class MaxySubModule:
     
     def set_immediate_target(self, target):
         target = clamp(target, self.module.TARGET_MIN, self.module.TARGET_MAX)
-        if target != self._target:
+        if target != self._target or self.module.FORCE_IMMEDIATE:
+            undo = (self, "_target", self._target)
             self._target = target
             self.module.controller.send_message(
                 MaxyMessages.set_sub_module_immediate_target_message(
                     self.module.module_index,
                     self.sub_module_id,
                     target,
-                ))
+                ),
+                undo=undo)
     
     immediate_target = property(fset=set_immediate_target)
 
 
 class MaxModuleDef:
 
+    __slots__ = ("name", "module_type", "sub_module_names")
+
     def __init__(self, name, module_type, sub_modules=None):
         self.name = name
         self.module_type = module_type
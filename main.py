@@ -25,36 +25,46 @@ port = "COM7"
 retry_count = 0
 
 
-def clamp(value, min_value, max_value):
-    return min(max_value, max(min_value, value))
+# Small exponential backoff ( 5, 10, 20 sec )
+RETRY_DELAYS = (5, 10, 20)
 
 
 def retry_delay(count):
-    # Uses a small exponential backoff ( 5, 10, 20 sec )
-    return 5 * 2 ** clamp(count, 0, 2)
+    return RETRY_DELAYS[2 if count > 2 else count if count > 0 else 0]
+
+
+def update_targets(targets):
+    maxy.name.Right1.immediate_target = 0
+    for module, low, high in targets:
+        module.target = random.randrange(low, high)
 
 
 while True:
     try:
         print(f"Connecting to serial port {port}")
         retry_count += 1
-        maxy.connect(port, 9600, 5)
-        maxy.set_global_intensity(3)
+        with maxy.batch():
+            maxy.connect(port, 9600, 5)
+            maxy.set_global_intensity(3)
         #maxy.reconnect()
         print("Connected!")
         retry_count = 0
+        # Each module with its randrange bounds (high is exclusive), in send order
+        targets = (
+            (maxy.name.Right1, -9999999, 10000000),
+            (maxy.name.tail1, -999, 10000),
+            (maxy.name.tail2, -999, 1000),
+            (maxy.index[1], -9999999, 10000000),
+            (maxy.name.Right3, -9999999, 10000000),
+            (maxy.index[3], -9999999, 10000000),
+            (maxy.name.Left1, -9999, 10000),
+            (maxy.name.Left2, -999, 1000),
+            (maxy.name.Left3, -99, 100),
+            (maxy.name.Left4, -9, 10),
+        )
         while True:
-            maxy.name.Right1.immediate_target = 0
-            maxy.name.Right1.target = random.randint(-9999999, 9999999)
-            maxy.name.tail1.target = random.randint(-999, 9999)
-            maxy.name.tail2.target = random.randint(-999, 999)
-            maxy.index[1].target = random.randint(-9999999, 9999999)
-            maxy.name.Right3.target = random.randint(-9999999, 9999999)
-            maxy.index[3].target = random.randint(-9999999, 9999999)
-            maxy.name.Left1.target = random.randint(-9999, 9999)
-            maxy.name.Left2.target = random.randint(-999, 999)
-            maxy.name.Left3.target = random.randint(-99, 99)
-            maxy.name.Left4.target = random.randint(-9, 9)
+            with maxy.batch():
+                update_targets(targets)
             time.sleep(4.5)
     except serial.serialutil.SerialTimeoutException:
         print("Write timeout")
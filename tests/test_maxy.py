@@ -0,0 +1,165 @@
+import threading
+import unittest
+from unittest import mock
+
+import serial
+
+from Maxy import MaxModuleDef, MaxyController, MaxyMessages, MaxyModule_8x7seg
+
+
+class FakePort:
+
+    def __init__(self, fail_after=None):
+        self.writes = []
+        self.fail_after = fail_after
+        self.writing = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def isOpen(self):
+        return True
+
+    def write(self, data):
+        self.writing.set()
+        self.release.wait(5)
+        if self.fail_after is not None and len(self.writes) >= self.fail_after:
+            raise serial.SerialException("port failed")
+        self.writes.append(data)
+        return len(data)
+
+
+def make_controller():
+    maxy = MaxyController()
+    maxy.define_modules([
+        MaxModuleDef("a", MaxyModule_8x7seg),
+        MaxModuleDef("b", MaxyModule_8x7seg),
+    ])
+    return maxy
+
+
+def connect(maxy, port, **kwargs):
+    with mock.patch("serial.Serial", return_value=port):
+        maxy.connect("fake", **kwargs)
+
+
+def wait_until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("Timed out waiting for the background writer")
+
+
+def wait_for_writes(port, count):
+    wait_until(lambda: len(port.writes) >= count)
+
+
+class MessageTests(unittest.TestCase):
+
+    def test_speed_divider_uses_its_own_opcode(self):
+        self.assertEqual(MaxyMessages.set_module_speed_divider(1, 300), b"\xfd\x47\x01\x01\x2c\xfe")
+
+    def test_module_intensity_is_range_checked(self):
+        with self.assertRaises(ValueError):
+            MaxyMessages.set_module_intensity(3, 16)
+
+    def test_sub_module_immediate_target_checks_sub_module(self):
+        with self.assertRaises(ValueError):
+            MaxyMessages.set_sub_module_immediate_target_message(0, 8, 0)
+
+
+class BatchTests(unittest.TestCase):
+
+    def test_batch_coalesces_repeated_targets(self):
+        maxy = make_controller()
+        port = FakePort()
+        connect(maxy, port)
+        port.writes.clear()
+        with maxy.batch():
+            maxy.name.a.target = 1
+            maxy.name.b.target = 2
+            maxy.name.a.immediate_target = 3
+            maxy.name.a.target = 4
+            maxy.name.a.target = 5
+        self.assertEqual(port.writes, [
+            b"\xfd\x43\x01\x00\x00\x00\x00\x02\xfe"
+            b"\xfd\x45\x00\x00\x00\x00\x00\x03\xfe"
+            b"\xfd\x43\x00\x00\x00\x00\x00\x05\xfe"
+        ])
+
+    def test_batch_dropped_on_raise_does_not_block_resending(self):
+        maxy = make_controller()
+        port = FakePort()
+        connect(maxy, port)
+        port.writes.clear()
+        with self.assertRaises(RuntimeError):
+            with maxy.batch():
+                maxy.name.a.target = 7
+                maxy.name.a.target = 8
+                maxy.name.b.immediate_target = 9
+                maxy.name.a.intensity = 5
+                raise RuntimeError("body")
+        self.assertEqual(port.writes, [])
+        self.assertEqual(maxy.name.a.target, 0)
+
+        maxy.name.a.target = 7
+        maxy.name.b.immediate_target = 9
+        maxy.name.a.intensity = 5
+        self.assertEqual(port.writes, [
+            b"\xfd\x43\x00\x00\x00\x00\x00\x07\xfe",
+            b"\xfd\x45\x01\x00\x00\x00\x00\x09\xfe",
+            b"\xfd\x46\x00\x05\xfe",
+        ])
+
+
+class BackgroundWriteTests(unittest.TestCase):
+
+    def test_writer_error_is_raised_on_next_send(self):
+        maxy = make_controller()
+        port = FakePort(fail_after=1)
+        connect(maxy, port, background_writes=True)
+        maxy.name.a.target = 1
+        for _ in range(500):
+            try:
+                maxy.name.a.target += 1
+            except serial.SerialException:
+                return
+            threading.Event().wait(0.01)
+        self.fail("The writer error was never raised")
+
+    def test_old_writer_error_does_not_leak_into_new_connection(self):
+        maxy = make_controller()
+        old_port = FakePort(fail_after=1)
+        connect(maxy, old_port, background_writes=True)
+        wait_for_writes(old_port, 1)
+        old_port.writing.clear()
+        old_port.release.clear()
+        maxy.name.a.target = 1
+        self.assertTrue(old_port.writing.wait(5))
+
+        old_writer = maxy._writer
+        new_port = FakePort()
+        connect(maxy, new_port, background_writes=True)
+        # The old writer only fails once the new connection is already up
+        old_port.release.set()
+        wait_until(lambda: old_writer.error is not None)
+
+        maxy.name.a.target = 2
+        wait_for_writes(new_port, 2)
+        self.assertEqual(new_port.writes[-1], b"\xfd\x43\x00\x00\x00\x00\x00\x02\xfe")
+
+
+    def test_stalled_port_raises_after_write_timeout(self):
+        maxy = make_controller()
+        port = FakePort()
+        connect(maxy, port, write_timeout=0.05, background_writes=True)
+        wait_for_writes(port, 1)
+        port.release.clear()
+        with self.assertRaises(serial.SerialTimeoutException):
+            for target in range(1, 1000):
+                maxy.name.a.target = target
+        port.release.set()
+
+
+if __name__ == "__main__":
+    unittest.main()